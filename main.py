@@ -1,14 +1,147 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import os
-from openpyxl import Workbook
+import re
+import xlsxwriter
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared default for missing or null lists in API payloads; an empty tuple is never reallocated
+_EMPTY = ()
+
+# Excel worksheet titles are limited to 31 characters and may not contain any of []:*?/\
+_MAX_SHEET_TITLE = 31
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+# Formatters for ClickUp custom field values, keyed by field type.
+# Each takes the (non-None) field value, the field dictionary and the exporter's option cache
+# (see _option_names) and returns a string.
+
+def _fmt_str(field_value, field, option_cache):
+    return str(field_value)
+
+
+def _fmt_checkbox(field_value, field, option_cache):
+    return "Yes" if field_value else "No"
+
+
+def _option_names(field, option_cache):
+    """
+    Map the option IDs of a dropdown/labels field to their display names.
+
+    The same field definition is repeated on every task, so the map is stored in
+    option_cache under the custom field ID and built only once per export.
+    """
+    field_id = field.get("id")
+    name_by_id = option_cache.get(field_id)
+    if name_by_id is None:
+        type_config = field.get("type_config")
+        options = (type_config.get("options") if type_config else None) or _EMPTY
+        name_by_id = {option.get("id"): option.get("name", "") for option in options}
+        if field_id is not None:
+            option_cache[field_id] = name_by_id
+    return name_by_id
+
+
+def _fmt_dropdown(field_value, field, option_cache):
+    if isinstance(field_value, str):
+        # fallback - if not found
+        return _option_names(field, option_cache).get(field_value, field_value)
+    elif isinstance(field_value, dict):
+        return field_value.get("name", "")
+    else:
+        return str(field_value)
+
+
+def _fmt_multi(field_value, field, option_cache):
+    if isinstance(field_value, list):
+        name_by_id = _option_names(field, option_cache)
+        _isinstance = isinstance
+        names = []
+        append = names.append
+        for item in field_value:
+            if _isinstance(item, dict):
+                if "name" in item:
+                    append(item["name"])
+            elif item in name_by_id:
+                # search by ID
+                append(name_by_id[item])
+        return ", ".join(names)
+    return ""
+
+
+def _fmt_ms(field_value, field, option_cache):
+    return str(field_value / 1000)  # ms to seconds
+
+
+def _fmt_users(field_value, field, option_cache):
+    if isinstance(field_value, list):
+        return ", ".join(user.get("username", "") for user in field_value if isinstance(user, dict))
+    return ""
+
+
+def _fmt_location(field_value, field, option_cache):
+    if isinstance(field_value, dict):
+        return field_value.get("name", "")
+    return ""
+
+
+def _fmt_relationship(field_value, field, option_cache):
+    if isinstance(field_value, list):
+        return ", ".join(linked_task.get("name", "") for linked_task in field_value if linked_task)
+    return ""
+
+
+def _fmt_formula(field_value, field, option_cache):
+    if isinstance(field_value, dict):
+        return field_value.get("text", "")
+    return ""
+
+
+def _fmt_username(field_value, field, option_cache):
+    if isinstance(field_value, dict):
+        return field_value.get("username", "")
+    return ""
+
+
+_FIELD_HANDLERS = {
+    "text": _fmt_str,
+    "short_text": _fmt_str,
+    "email": _fmt_str,
+    "phone": _fmt_str,
+    "url": _fmt_str,
+    "number": _fmt_str,
+    "rating": _fmt_str,
+    "auto_increment": _fmt_str,
+    "checkbox": _fmt_checkbox,
+    "dropdown": _fmt_dropdown,
+    "labels": _fmt_multi,
+    "multi_select": _fmt_multi,
+    "date": _fmt_ms,
+    "time": _fmt_ms,
+    "users": _fmt_users,
+    "location": _fmt_location,
+    "relationship": _fmt_relationship,
+    "formula": _fmt_formula,
+    "created_by": _fmt_username,
+    "updated_by": _fmt_username,
+}
+
 
 class ClickUpExporter:
     """
     A class for exporting tasks from multiple ClickUp lists into a single Excel workbook.
     """
 
+    # Maximum number of tasks returned by the ClickUp API per page
+    PAGE_SIZE = 100
+
+    # Upper bound for concurrent list fetches; also the size of the HTTP connection pool
+    MAX_CONNECTIONS = 8
+
     def __init__(self, api_token, team_id, list_ids, output_path, output_filename_format):
         """
         Initialize the ClickUpExporter object.
@@ -26,10 +159,30 @@ class ClickUpExporter:
         self.output_path = output_path
         self.output_filename_format = output_filename_format
 
+        # One pooled session so that all list fetches reuse the HTTPS connections
+        self._session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        self._session.mount("https://", HTTPAdapter(
+            pool_connections=self.MAX_CONNECTIONS, pool_maxsize=self.MAX_CONNECTIONS, max_retries=retries
+        ))
+        self._session.headers["Authorization"] = api_token
+
+        # id -> name maps of dropdown/labels options for the current export, keyed by custom field ID
+        self._option_cache = {}
+
+    def close(self):
+        """
+        Close the underlying HTTP session and release its pooled connections.
+        """
+        self._session.close()
+
     def _get_tasks_from_list(self, list_id):
         """
         Retrieve tasks from a specific ClickUp list.
 
+        The ClickUp API returns at most 100 tasks per page, so pages are requested
+        one after another until a short or empty page is returned.
+
         Args:
             list_id (str): The ClickUp list ID.
 
@@ -37,16 +190,44 @@ class ClickUpExporter:
             list: A list of task dictionaries.
         """
         url = f"https://api.clickup.com/api/v2/list/{list_id}/task"
-        headers = {"Authorization": self.api_token}
-        params = {"include_subtasks": "true"}
+        # "subtasks" is the flag the API recognises; subtasks come back as regular rows of the list.
+        # Closed tasks are left out by default, so "include_closed" keeps them in the backup.
+        # "custom_fields" is a task filter, not a field projection, so the payload cannot be narrowed further.
+        params = {"subtasks": "true", "include_closed": "true", "archived": "false", "page": 0}
+        tasks = []
+        page = 0
         try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json().get("tasks", [])
-        except requests.exceptions.RequestException as e:
+            while True:
+                params["page"] = page
+                response = self._session.get(url, params=params, timeout=(5, 30))
+                response.raise_for_status()
+                data = orjson.loads(response.content)
+                page_tasks = data.get("tasks", [])
+                tasks.extend(page_tasks)
+                if len(page_tasks) < self.PAGE_SIZE or data.get("last_page"):
+                    return tasks
+                page += 1
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             print(f"Error retrieving tasks from list with ID {list_id}: {e}")
             return []
 
+    def _fetch_all(self):
+        """
+        Retrieve tasks from all configured ClickUp lists concurrently.
+
+        All lists are requested at once, but results are yielded in the order of list_ids
+        as soon as each one is available, so the caller can write a sheet while later lists
+        are still being fetched.
+
+        Yields:
+            tuple: The sheet name and the list of task dictionaries for that sheet.
+        """
+        if not self.list_ids:
+            return
+        with ThreadPoolExecutor(max_workers=min(len(self.list_ids), self.MAX_CONNECTIONS)) as executor:
+            results = executor.map(self._get_tasks_from_list, self.list_ids.values())
+            yield from zip(self.list_ids, results)
+
     def _get_field_value(self, field):
         """
         Retrieves and formats the value of a custom field in a ClickUp task.
@@ -57,150 +238,127 @@ class ClickUpExporter:
         Returns:
             str: The formatted value of the field as a string. Handles various ClickUp field types.
         """
-        field_name = field.get("name")
-        field_type = field.get("type")
         field_value = field.get("value")
-
         if field_value is None:
             return ""
+        return _FIELD_HANDLERS.get(field.get("type"), _fmt_str)(field_value, field, self._option_cache)
 
-        if field_type in ["text", "short_text", "email", "phone", "url"]:
-            return str(field_value)
-
-        elif field_type in ["number", "rating", "auto_increment"]:
-            return str(field_value)
-
-        elif field_type == "checkbox":
-            return "Yes" if field_value else "No"
-
-        elif field_type == "dropdown":
-            # New Correct Logic:
-            if isinstance(field_value, str):
-                options = field.get("type_config", {}).get("options", [])
-                for option in options:
-                    if option.get("id") == field_value:
-                        return option.get("name", "")
-                # fallback - if not found
-                return field_value
-            elif isinstance(field_value, dict):
-                return field_value.get("name", "")
-            else:
-                return str(field_value)
-
-        elif field_type == "labels" or field_type == "multi_select":
-            if isinstance(field_value, list):
-                names = []
-                options = field.get("type_config", {}).get("options", [])
-                for item in field_value:
-                    if isinstance(item, dict) and "name" in item:
-                        names.append(item["name"])
-                    else:
-                        # search by ID
-                        for option in options:
-                            if option.get("id") == item:
-                                names.append(option.get("name", ""))
-                return ", ".join(names)
-            return ""
-
-        elif field_type == "date" or field_type == "time":
-            return str(field_value / 1000)  # ms to seconds
-
-        elif field_type == "users":
-            if isinstance(field_value, list):
-                return ", ".join(user.get("username", "") for user in field_value if isinstance(user, dict))
-            else:
-                return ""
-
-        elif field_type == "location":
-            if isinstance(field_value, dict):
-                return field_value.get("name", "")
-            return ""
-
-        elif field_type == "relationship":
-            if isinstance(field_value, list):
-                return ", ".join(linked_task.get("name", "") for linked_task in field_value if linked_task)
-            return ""
-
-        elif field_type == "formula":
-            if isinstance(field_value, dict):
-                return field_value.get("text", "")
-            return ""
-
-        elif field_type in ["created_by", "updated_by"]:
-            if isinstance(field_value, dict):
-                return field_value.get("username", "")
-            return ""
-
-        else:
-            return str(field_value)
-
-    def _process_task(self, task, custom_field_names):
+    def _process_task(self, task, col_index, ncols):
         """
         Processes a single task, extracting its name and all custom fields.
 
         Args:
             task (dict): The ClickUp task dictionary.
-            custom_field_names (dict): Dictionary of all unique custom fields names across tasks.
+            col_index (dict): Mapping of custom field names to their column index (0-based, after the task name).
+            ncols (int): Number of custom field columns in the sheet.
 
         Returns:
-            list: A list with the task name and custom field values.
+            list: A list with the task name and custom field values, allocated once at its final size
+                and written to the sheet as is.
         """
-        row_data = [task.get("name", "")]
-        custom_field_values = {name: "" for name in custom_field_names.keys()}
+        row_data = [""] * (ncols + 1)
+        row_data[0] = task.get("name", "")
 
-        for field in task.get("custom_fields", []):
-            field_name = field.get("name")
-            if field_name in custom_field_values:
-                custom_field_values[field_name] = self._get_field_value(field)
+        # col_index doubles as the set of exported columns: a miss means the field has no column
+        column_of = col_index.get
+        for field in task.get("custom_fields") or _EMPTY:
+            i = column_of(field.get("name"))
+            if i is not None:
+                row_data[i + 1] = self._get_field_value(field)
 
-        row_data.extend(custom_field_values.values())
         return row_data
 
-    def export_to_excel(self):
+    def _sheet_titles(self):
         """
-        Exports the tasks from specified lists into an Excel file.
-        Each ClickUp list is saved into a separate Excel sheet.
+        Maps each configured sheet name to a valid, unique Excel worksheet title.
+
+        Excel rejects titles longer than 31 characters, titles containing []:*?/\\ or
+        starting/ending with an apostrophe, and titles that differ only in case. Such names
+        are adjusted here, before any list is fetched, instead of aborting the export once
+        all lists have been downloaded.
+
+        Returns:
+            dict: A dictionary with configured sheet names as keys and worksheet titles as values.
         """
-        try:
-            workbook = Workbook()
+        titles = {}
+        used = set()
+        for sheet_name in self.list_ids:
+            base = _INVALID_SHEET_CHARS.sub("_", sheet_name)[:_MAX_SHEET_TITLE].strip("'") or "Sheet"
+            title = base
+            n = 1
+            while title.lower() in used:
+                n += 1
+                suffix = f" ({n})"
+                title = base[:_MAX_SHEET_TITLE - len(suffix)] + suffix
+            used.add(title.lower())
+            if title != sheet_name:
+                print(f"Sheet name '{sheet_name}' cannot be used as an Excel sheet title, using '{title}' instead.")
+            titles[sheet_name] = title
+        return titles
+
+    def _write_workbook(self, filepath, sheet_titles):
+        """
+        Writes the tasks from all lists into a new Excel file, one sheet per ClickUp list.
+
+        The workbook is closed even if writing fails, so XlsxWriter removes its
+        per-sheet temp files; the file at filepath may then be incomplete.
 
-            for sheet_name, list_id in self.list_ids.items():
-                tasks = self._get_tasks_from_list(list_id)
+        Args:
+            filepath (str): Path of the Excel file to create.
+            sheet_titles (dict): Worksheet title for each configured sheet name, see _sheet_titles.
+        """
+        # constant_memory flushes each row to a temp file as soon as the next one starts
+        workbook = xlsxwriter.Workbook(filepath, {"constant_memory": True, "strings_to_urls": False})
+        try:
+            # The workbook is not thread-safe, so sheets are written here one by one while
+            # the remaining lists keep downloading in the background
+            for sheet_name, tasks in self._fetch_all():
                 if not tasks:
                     print(f"No tasks found for export from list '{sheet_name}'.")
                     continue
 
-                sheet = workbook.create_sheet(title=sheet_name)
-                headers = ["Task Name"]
-                custom_field_names = {}
-
-                for task in tasks:
-                    for field in task.get("custom_fields", []):
-                        custom_field_names[field.get("name")] = True
-
-                headers.extend(custom_field_names.keys())
-                sheet.append(headers)
-
-                for task in tasks:
-                    row_data = self._process_task(task, custom_field_names)
-                    sheet.append(row_data)
-
-            # Remove the default 'Sheet' if more sheets have been created
-            if len(workbook.sheetnames) > 1 and "Sheet" in workbook.sheetnames:
-                del workbook["Sheet"]
+                sheet = workbook.add_worksheet(sheet_titles[sheet_name])
+                # Column order follows the first appearance of each custom field;
+                # headers must be known before any row can be streamed
+                custom_field_names = dict.fromkeys(
+                    field.get("name")
+                    for task in tasks
+                    for field in task.get("custom_fields") or _EMPTY
+                )
+                sheet.write_row(0, 0, ("Task Name", *custom_field_names))
+
+                col_index = {name: i for i, name in enumerate(custom_field_names)}
+                ncols = len(col_index)
+                rows = (self._process_task(task, col_index, ncols) for task in tasks)
+                for row_idx, row in enumerate(rows, start=1):
+                    sheet.write_row(row_idx, 0, row)
+        finally:
+            workbook.close()
 
+    def export_to_excel(self):
+        """
+        Exports the tasks from specified lists into an Excel file.
+        Each ClickUp list is saved into a separate Excel sheet.
+        """
+        try:
+            # Field options may have changed since a previous export
+            self._option_cache = {}
+            sheet_titles = self._sheet_titles()
             output_filename = self.output_filename_format.format(date=datetime.date.today().strftime('%Y-%m-%d'))
             filepath = os.path.join(self.output_path, output_filename)
-            workbook.save(filepath)
+            # Write under a temporary name so that a failed run never leaves
+            # a partial workbook under the dated backup name
+            tmp_filepath = f"{filepath}.part"
+            try:
+                self._write_workbook(tmp_filepath, sheet_titles)
+                os.replace(tmp_filepath, filepath)
+            finally:
+                if os.path.exists(tmp_filepath):
+                    os.remove(tmp_filepath)
             print(f"Data from lists saved to: {filepath}")
 
         except Exception as e:
             print(f"Error during Excel file saving: {e}")
-        finally:
-            try:
-                workbook.close()
-            except Exception as e:
-                print(f"Error closing the Excel file: {e}")
 
 if __name__ == "__main__":
     # Configuration
@@ -216,11 +374,20 @@ if __name__ == "__main__":
 
     # Reading the path from BackupPath.txt
     with open('BackupPath.txt', 'r') as file:
-        content = file.read()
+        # Strip the trailing newline editors add, otherwise the path is invalid
+        content = file.read().strip()
         print(f"Saving backup to: {content}")
 
+    # Create a missing backup directory up front instead of failing at save time, after all API calls.
+    # An empty path means the current directory.
+    if content:
+        os.makedirs(content, exist_ok=True)
+
     OUTPUT_PATH = content
     OUTPUT_FILENAME = f"0000 Kontakty_BACKUP[{{date}}].xlsx"
 
     exporter = ClickUpExporter(CLICKUP_API_TOKEN, CLICKUP_TEAM_ID, LIST_IDS, OUTPUT_PATH, OUTPUT_FILENAME)
-    exporter.export_to_excel()
+    try:
+        exporter.export_to_excel()
+    finally:
+        exporter.close()